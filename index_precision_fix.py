@@ -10,28 +10,27 @@ Description:
     
     Formula: Quantity_Final = TRUNC( Base * (1 + p) )
     
-    This script ensures that 'p' is calculated with arbitrary precision (Decimal)
-    and includes an 'epsilon' safe-guard to prevent off-by-one errors during 
-    system truncation.
+    This script ensures that 'p' is calculated with exact integer arithmetic
+    (reported as Decimal) and includes an 'epsilon' safe-guard to prevent
+    off-by-one errors during system truncation.
 
 Features:
-    - Uses 'decimal' library for arbitrary precision (50 places).
+    - Exact arbitrary-precision integer math; 'decimal' only for the reported 'p'.
     - Implements a 'truncation-safe' logic to find the smallest valid 'p'.
+    - Optional Numba-compiled integer kernel for batch calculation (exact, no floats).
     - Auto-detects headers in input files (Excel/CSV resilience).
     - Generates a detailed audit log (Excel) with proof of calculation.
 """
 
 from __future__ import annotations
-from decimal import Decimal, getcontext, ROUND_UP
-import pandas as pd
-import xlrd
-import re, datetime, argparse
+from decimal import Decimal
+import datetime, argparse, os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from importlib.util import find_spec
 from pathlib import Path
 from typing import Optional, Tuple
 
-# Set precision to 50 decimal places to avoid standard float errors
-getcontext().prec = 50
-
 # ---- CLI Arguments ----
 parser = argparse.ArgumentParser(description='Financial Index Precision Calculator')
 parser.add_argument('--base', default='assets_base.xlsx', help="Base Quantity File (Current Portfolio)")
@@ -39,22 +38,51 @@ parser.add_argument('--secondary', default='assets_secondary.xlsx', help="Second
 parser.add_argument('--target', default='target_portfolios.xlsx', help="Target Theoretical Portfolios")
 parser.add_argument('--output', default='adjustment_results.xlsx', help='Output Excel File')
 parser.add_argument('--no-cover', action='store_true', help='Skip instruction cover sheet')
-args = parser.parse_args()
+parser.add_argument('--workers', type=int, default=None, help='Processes for target sheets (default: CPU count)')
+if __name__ == '__main__':
+    # Worker processes re-import this module; only the main process parses the CLI
+    args = parser.parse_args()
+
+# Heavy imports after argument parsing, so --help and usage errors return immediately
+import numpy as np
+import pandas as pd
+
+try:
+    from numba import njit  # Optional: compiles the integer fast path
+except ImportError:
+    njit = None
 
 SCRIPT_DIR = Path(__file__).resolve().parent
-BASE_FILE = (SCRIPT_DIR / args.base).resolve()
-SEC_FILE = (SCRIPT_DIR / args.secondary).resolve()
-TARGET_FILE = (SCRIPT_DIR / args.target).resolve()
-OUTPUT_FILE = (SCRIPT_DIR / args.output).resolve()
 
 DECIMAL_PLACES = 13  # Standard for financial transaction systems
 
+# Streaming Rust reader (pandas >= 2.2 + python-calamine); openpyxl DOM parse otherwise
+READ_ENGINE = 'calamine' if find_spec('python_calamine') else 'openpyxl'
+
 # ---- Utils ----
 now = lambda: datetime.datetime.now().strftime('%H:%M:%S')
 log = lambda m: print(f"[{now()}] {m}")
-norm = lambda s: re.sub(r'\s+', ' ', str(s).strip()).lower()
+
+def norm(s) -> str:
+    """Collapses whitespace and lowercases a header (C-level str.split, no regex)."""
+    return ' '.join(str(s).split()).lower()
+
+@lru_cache(maxsize=None)
+def column_map(columns: tuple) -> dict:
+    """Maps normalized header -> original label. Cached, since portfolio sheets usually share headers."""
+    return {norm(c): c for c in columns}
+
 from unicodedata import normalize as _ud_norm
-noacc = lambda s: _ud_norm('NFKD', str(s)).encode('ASCII','ignore').decode('ASCII').lower()
+# Latin-1 + Latin Extended-A/B folded once at load: 'é' -> 'e', 'ñ' -> 'n', '×' -> ''
+_ACCENT_TABLE = {cp: _ud_norm('NFKD', chr(cp)).encode('ASCII','ignore').decode('ASCII')
+                 for cp in range(0x80, 0x250)}
+
+def noacc(s) -> str:
+    """Strips accents via str.translate; NFKD only for characters outside the table."""
+    s = str(s).translate(_ACCENT_TABLE)
+    if not s.isascii():
+        s = _ud_norm('NFKD', s).encode('ASCII','ignore').decode('ASCII')
+    return s.lower()
 
 def safe_decimal_int(x) -> Optional[int]:
     """Safely converts a value to int using Decimal to avoid float artifacts."""
@@ -65,6 +93,48 @@ def safe_decimal_int(x) -> Optional[int]:
     except Exception:
         return None
 
+def safe_int_series(col: pd.Series) -> pd.Series:
+    """
+    Vectorized safe_decimal_int. Whole numbers below 2**53 (exact in float64)
+    are cast at C speed; fractions, text and larger values fall back to the
+    Decimal path. Returns nullable Int64, or object if a value exceeds int64.
+    """
+    # pd.to_numeric reads dates/timedeltas as epoch ints and bools as 0/1,
+    # all of which safe_decimal_int rejects; keep those on the per-cell path
+    if col.dtype.kind not in 'iufO':
+        return pd.Series([safe_decimal_int(x) for x in col], index=col.index, dtype=object)
+    num = col
+    if col.dtype.kind == 'O':
+        num = col.mask(col.map(lambda x: isinstance(x, (bool, np.bool_))).astype(bool))
+    v = pd.to_numeric(num, errors='coerce')
+    if v.dtype.kind == 'i':
+        return v.astype('Int64')
+    if v.dtype.kind != 'f':
+        return pd.Series([safe_decimal_int(x) for x in col], index=col.index, dtype=object)
+    f = v.to_numpy()
+    with np.errstate(invalid='ignore'):
+        fast = np.isfinite(f) & (f == np.trunc(f)) & (np.abs(f) < 2 ** 53)
+    out = pd.Series(np.where(fast, f, np.nan), index=col.index).astype('Int64')
+
+    slow = ~fast & col.notna().to_numpy()
+    if slow.any():
+        fixed = [safe_decimal_int(x) for x in col[slow]]
+        if any(x is not None and not -2 ** 63 <= x < 2 ** 63 for x in fixed):
+            out = out.astype(object)
+        out[slow] = [pd.NA if x is None else x for x in fixed]
+    return out
+
+def _p_from_k(k: int, N: int) -> Decimal:
+    """Exact p = k * 10**-N, built from the digits of k so no context rounding applies."""
+    sign, digits, _ = Decimal(k).as_tuple()
+    return Decimal((sign, digits, -N))
+
+@lru_cache(maxsize=None)
+def _n_consts(N: int) -> Tuple[int, Decimal, Decimal]:
+    """Per-N constants, built once: scale 10**N and the p of the B == T / T == 0 shortcuts."""
+    S = 10 ** N
+    return S, _p_from_k(0, N), _p_from_k(-S, N)
+
 def calculate_safe_adjustment(B: int, T: int, N: int = DECIMAL_PLACES) -> Tuple[Optional[Decimal], Optional[int], bool]:
     """
     Core Logic: Finds the smallest 'p' (percentage) that satisfies:
@@ -79,198 +149,383 @@ def calculate_safe_adjustment(B: int, T: int, N: int = DECIMAL_PLACES) -> Tuple[
         B = int(B); T = int(T)
         if B == 0:
             return None, None, False
-            
-        Bd = Decimal(B); Td = Decimal(T)
-        
-        # Define step (quantum) and safety epsilon
-        q = Decimal('1e-' + str(N))
-        EPS = Decimal('1e-' + str(N+2))
-        
-        # Theoretical lower bound
-        lower_bound = (Td / Bd) - Decimal(1)
-        
-        # Candidate p = ceil(lower_bound + epsilon)
-        candidate_p = (lower_bound + EPS).quantize(q, rounding=ROUND_UP)
-        
-        # Validation Trial
-        trial_qty = Bd * (Decimal(1) + candidate_p)
-        
-        # If trial fails (due to internal precision limits), bump p by one quantum
-        if int(trial_qty) < int(Td):
-            candidate_p = (candidate_p + q).quantize(q, rounding=ROUND_UP)
-            trial_qty = Bd * (Decimal(1) + candidate_p)
-            
-        return candidate_p, int(trial_qty), int(trial_qty) == T
+        # Unchanged position (p = 0) and full exit (p = -1) need no search
+        _, p_unchanged, p_exit = _n_consts(N)
+        if B == T:
+            return p_unchanged, T, True
+        if T == 0:
+            return p_exit, 0, True
+        k, trial_qty = _calc_cached(B, T, N)
+        return _p_from_k(k, N), trial_qty, trial_qty == T
     except Exception:
         return None, None, False
 
-# ---- 1. Load Base Assets (Current Positions) ----
-log(f"Loading Base Assets: {BASE_FILE.name}")
-try:
-    df_base = pd.read_excel(BASE_FILE, sheet_name=0, engine='openpyxl')
-except FileNotFoundError:
-    log("Base file not found. Please provide a valid .xlsx file.")
-    exit(1)
-
-# Dynamic Column Mapping (Agnostic to file format)
-colmap = {norm(c): c for c in df_base.columns}
-col_code = colmap.get('ticker') or colmap.get('symbol') or colmap.get('code')
-# Logic to find the quantity column (looks for 'qty', 'shares', 'position')
-col_qty = None
-for k, v in colmap.items():
-    if ('qty' in k) or ('quantity' in k) or ('position' in k):
-        col_qty = v; break
-
-if not col_code or not col_qty:
-    # Fallback for demo purposes if columns are missing
-    log("Warning: Specific columns not found, using generic column indices 0 and 1.")
-    df_base.columns = ['Ticker', 'Qty'] + list(df_base.columns[2:])
-    col_code = 'Ticker'
-    col_qty = 'Qty'
-
-df_base['NORMALIZED_CODE'] = df_base[col_code].astype(str).str.strip()
-df_base['BASE_QTY'] = df_base[col_qty].apply(safe_decimal_int)
-base_lookup = dict(zip(df_base['NORMALIZED_CODE'], df_base['BASE_QTY']))
-log(f"Base Assets Loaded: {len(base_lookup)} records.")
-
-# ---- 2. Load Secondary Assets (Optional - e.g. DRs/Receipts) ----
-base_sec_lookup = {}
-if SEC_FILE.exists():
-    log(f"Loading Secondary Assets: {SEC_FILE.name}")
-    df_sec = pd.read_excel(SEC_FILE, sheet_name=0, engine='openpyxl')
-    # ... (Similar dynamic mapping logic would go here) ...
-    # Simplified for the portfolio version:
-    colmap_sec = {norm(c): c for c in df_sec.columns}
-    col_code_sec = colmap_sec.get('ticker') or list(df_sec.columns)[0]
-    col_qty_sec = colmap_sec.get('qty') or list(df_sec.columns)[-1]
+@lru_cache(maxsize=1 << 20)
+def _calc_cached(B: int, T: int, N: int) -> Tuple[int, int]:
+    """
+    Memoized body of calculate_safe_adjustment, in exact Python-int arithmetic.
+    Returns (k, trial_qty) with p = k * 1e-N. (B, T) pairs repeat across portfolios.
+    """
+    S = _n_consts(N)[0]
     
-    df_sec['NORMALIZED_CODE'] = df_sec[col_code_sec].astype(str).str.strip()
-    df_sec['BASE_QTY'] = df_sec[col_qty_sec].apply(safe_decimal_int)
-    base_sec_lookup = dict(zip(df_sec['NORMALIZED_CODE'], df_sec['BASE_QTY']))
-
-# ---- 3. Process Target Portfolios ----
-log(f"Processing Target Portfolios: {TARGET_FILE.name}")
-if not TARGET_FILE.exists():
-    log("Target file not found. Creating dummy output for demonstration.")
-    sheet_names = []
-else:
-    xls = pd.ExcelFile(str(TARGET_FILE), engine='openpyxl')
-    sheet_names = xls.sheet_names
-
-writer = pd.ExcelWriter(str(OUTPUT_FILE), engine='openpyxl')
-summary_stats = []
-
-for sheet in sheet_names:
-    log(f"Analyzing Portfolio: {sheet}")
-    df_target = pd.read_excel(TARGET_FILE, sheet_name=sheet, engine='openpyxl')
+    # Candidate p = (T/B - 1) + EPS, in quanta of 1e-N (EPS = 1e-(N+2) = 1/100 quantum)
+    num = 100 * S * (T - B) + B
+    den = 100 * B
+    if den < 0:
+        num, den = -num, -den
+    
+    # Round away from zero (ROUND_UP) to a whole number of quanta
+    k = -(-abs(num) // den)
+    if num < 0:
+        k = -k
     
+    # Validation Trial: TRUNC( B * (1 + p) ), truncating toward zero like int(Decimal)
+    trial = B * (S + k)
+    trial_qty = abs(trial) // S * (1 if trial >= 0 else -1)
+    
+    # If trial fails, bump p by one quantum
+    if trial_qty < T:
+        k += 1
+        trial = B * (S + k)
+        trial_qty = abs(trial) // S * (1 if trial >= 0 else -1)
+        
+    return k, trial_qty
+
+def _safe_adj_int(B_arr, T_arr, N, out_k, out_proof, out_ok):
+    """
+    Integer-only version of calculate_safe_adjustment over int64 arrays.
+    Writes p as a count of 1e-N quanta (out_k) plus the proof quantity
+    (out_proof). Requires 0 < B < 2**56, 0 <= T < 2**62 and
+    |T - B| // B < 2**62 // 10**N, so that no intermediate value (including
+    the proof quantity T + f) leaves the int64 range.
+    """
+    S = 10 ** N
+    for i in range(B_arr.shape[0]):
+        B = B_arr[i]; T = T_arr[i]
+        if T == B or T == 0:
+            out_k[i] = 0 if T == B else -S
+            out_proof[i] = T
+            out_ok[i] = True
+            continue
+        D = T - B
+        neg = D < 0
+        if neg:
+            D = -D
+        # S * D / B == S*q + a + rem/B, by long division (never forms S * D)
+        q = D // B; rem = D - q * B; a = 0
+        for _ in range(N):
+            rem *= 10
+            a = a * 10 + rem // B
+            rem %= B
+        # k = (lower_bound + EPS) rounded away from zero in quanta;
+        # e = B*k - S*D, i.e. how far B*(1 + p) lands above T, in 1/S units
+        if not neg:
+            c = 1 if 100 * rem <= 99 * B else 2
+            k = S * q + a + c
+            e = B * c - rem
+        elif q == 0 and a == 0 and 100 * rem <= B:
+            k = 0 if 100 * rem == B else 1
+            e = B * k + rem
+        else:
+            c = 1 if 100 * rem > B else 0
+            k = -(S * q + a + c)
+            e = rem - B * c
+        # Validation Trial (bump p by one quantum if truncation falls short)
+        f = e // S
+        trial = T + f
+        if trial < 0 and f * S != e:
+            trial += 1
+        if trial < T:
+            k += 1; e += B
+            f = e // S
+            trial = T + f
+            if trial < 0 and f * S != e:
+                trial += 1
+        out_k[i] = k
+        out_proof[i] = trial
+        out_ok[i] = trial == T
+
+_safe_adj_int_jit = njit(cache=True)(_safe_adj_int) if njit else None
+
+def calculate_safe_adjustments(Bs, Ts, N: int = DECIMAL_PLACES) -> Tuple[list, list, list]:
+    """
+    Batch version of calculate_safe_adjustment. Rows that fit the int64 range
+    go through the compiled integer kernel (when Numba is available); the rest
+    use the pure-Python integer path. Returns (adjustment_factors, proof_qtys, is_valid).
+    """
+    Bs = [int(b) for b in Bs]; Ts = [int(t) for t in Ts]
+    n = len(Bs)
+    adj = [None] * n; proof = [None] * n; ok = [False] * n
+
+    fast = np.zeros(n, dtype=bool)
+    if _safe_adj_int_jit is not None and n:
+        try:
+            B_arr = np.asarray(Bs, dtype=np.int64)
+            T_arr = np.asarray(Ts, dtype=np.int64)
+        except (OverflowError, TypeError, ValueError):
+            B_arr = T_arr = None
+        if B_arr is not None:
+            fast = ((B_arr > 0) & (B_arr < 2 ** 56) & (T_arr >= 0) & (T_arr < 2 ** 62)
+                    & (np.abs(T_arr - B_arr) // np.maximum(B_arr, 1) < 2 ** 62 // _n_consts(N)[0]))
+            idx = np.flatnonzero(fast)
+            out_k = np.empty(len(idx), dtype=np.int64)
+            out_proof = np.empty(len(idx), dtype=np.int64)
+            out_ok = np.empty(len(idx), dtype=np.bool_)
+            _safe_adj_int_jit(np.ascontiguousarray(B_arr[idx]), np.ascontiguousarray(T_arr[idx]),
+                              N, out_k, out_proof, out_ok)
+            # Convert to Decimal only at the end, for the audit columns
+            for j, i in enumerate(idx.tolist()):
+                adj[i] = _p_from_k(int(out_k[j]), N)
+                proof[i] = int(out_proof[j])
+                ok[i] = bool(out_ok[j])
+
+    for i in np.flatnonzero(~fast).tolist():
+        adj[i], proof[i], ok[i] = calculate_safe_adjustment(Bs[i], Ts[i], N)
+    return adj, proof, ok
+
+def build_base_union(primary: pd.DataFrame, secondary: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+    """
+    Single NORMALIZED_CODE -> BASE_QTY table with a 'source' column, joined to each
+    portfolio with one merge. Within a file the last row of a code wins (as with
+    dict(zip(...))); a code with a primary quantity shadows the secondary one.
+    """
+    frames = []
+    for df, source in ((primary, 'PRIMARY'), (secondary, 'SECONDARY')):
+        if df is None:
+            continue
+        f = df[['NORMALIZED_CODE', 'BASE_QTY']].drop_duplicates('NORMALIZED_CODE', keep='last')
+        frames.append(f[f['BASE_QTY'].notna()].assign(source=source))
+    return pd.concat(frames, ignore_index=True).drop_duplicates('NORMALIZED_CODE', keep='first')
+
+AUDIT_COLUMNS = ['Ticker', 'Base_Qty', 'Target_Qty', 'Adjustment_Factor', 'Proof_Check', 'Status']
+
+def add_sheet(wb, name: str):
+    """Adds a worksheet under its 31-char Excel name, suffixing it if already taken."""
+    taken = {t.lower() for t in wb.sheetnames}
+    title = name[:31]; i = 1
+    while title.lower() in taken:
+        i += 1
+        title = f"{name[:31 - len(str(i)) - 1]}~{i}"
+    return wb.create_sheet(title)
+
+def write_rows(ws, header: list, rows) -> None:
+    """Streams a header plus rows into a write-only sheet, one row in memory at a time."""
+    ws.append(header)
+    for row in rows:
+        ws.append(row)
+
+# ---- Per-Sheet Worker (runs in a child process when --workers > 1) ----
+_worker = {}
+
+def _init_worker(target_path: str, base_union: pd.DataFrame, xls=None) -> None:
+    """Hands the read-only base table to a worker once, instead of pickling it per sheet."""
+    _worker.update(target=target_path, base=base_union, xls=xls)
+
+def _process_sheet(sheet: str) -> Tuple[str, Optional[tuple], int]:
+    """Builds the audit columns of one portfolio. Returns (sheet, columns or None if skipped, success_count)."""
+    log(f"Analyzing Portfolio: {sheet}")
+    if _worker['xls'] is None:
+        _worker['xls'] = pd.ExcelFile(_worker['target'], engine=READ_ENGINE)
+    raw = _worker['xls'].parse(sheet, header=None)
+    if raw.empty:
+        return sheet, None, 0
+
     # Header Detection Logic (finds where the data actually starts)
-    header_idx = 0
-    for i in range(min(20, len(df_target))):
-        row_str = str(df_target.iloc[i].values).lower()
-        if 'ticker' in row_str or 'symbol' in row_str:
-            header_idx = i; break
-            
-    df_target = pd.read_excel(TARGET_FILE, sheet_name=sheet, header=header_idx, engine='openpyxl')
+    hits = raw.head(20).astype(str).apply(
+        lambda r: r.str.contains('ticker|symbol', case=False, regex=True).any(), axis=1)
+    header_idx = int(hits.idxmax()) if hits.any() else 0
+
+    # Promote the header row in memory instead of re-reading the sheet
+    df_target = raw.iloc[header_idx + 1:].reset_index(drop=True)
+    df_target.columns = raw.iloc[header_idx].tolist()
+    df_target = df_target.loc[:, ~df_target.columns.duplicated()]
     
     # Normalize Columns
-    t_map = {norm(c): c for c in df_target.columns}
+    t_map = column_map(tuple(df_target.columns))
     t_code = t_map.get('ticker') or t_map.get('symbol')
     t_qty = t_map.get('quantity') or t_map.get('qty') or t_map.get('theoretical')
     
     if not t_code or not t_qty:
-        continue
+        return sheet, None, 0
 
-    results = []
-    success_count = 0
-    
-    for _, row in df_target.iterrows():
-        ticker = str(row.get(t_code, '')).strip()
-        target_qty = safe_decimal_int(row.get(t_qty))
-        
-        if not ticker or target_qty is None:
-            continue
-            
-        # Lookup Base Quantity (Primary or Secondary)
-        base_qty = base_lookup.get(ticker)
-        source = 'PRIMARY'
-        if base_qty is None:
-            base_qty = base_sec_lookup.get(ticker)
-            source = 'SECONDARY'
-            
-        if base_qty is None:
-            results.append({
-                'Ticker': ticker, 'Base_Qty': 'N/A', 'Target_Qty': target_qty, 
-                'Adjustment_Factor': 'N/A', 'Status': 'MISSING_BASE'
-            })
-            continue
-            
-        # Calculate!
-        adj_factor, proof_qty, is_valid = calculate_safe_adjustment(base_qty, target_qty)
-        
-        if is_valid:
-            success_count += 1
-            
-        results.append({
-            'Ticker': ticker,
-            'Base_Qty': base_qty,
-            'Target_Qty': target_qty,
-            'Adjustment_Factor': float(adj_factor) if adj_factor else None,
-            'Proof_Check': proof_qty,
-            'Status': 'OK' if is_valid else 'FAIL'
-        })
-        
-    pd.DataFrame(results).to_excel(writer, sheet_name=sheet[:31], index=False)
-    summary_stats.append({'Portfolio': sheet, 'Success': success_count, 'Total': len(results)})
+    # Vectorized pipeline: whole columns instead of per-row Series access
+    tk = df_target[t_code].astype(str).str.strip()
+    tq = safe_int_series(df_target[t_qty])
+    keep = tk.ne('') & tq.notna()
+    tk, tq = tk[keep], tq[keep]
+
+    # Lookup Base Quantity (Primary, falling back to Secondary) as one hash join
+    merged = pd.DataFrame({'NORMALIZED_CODE': tk.to_numpy(dtype=object), 'TARGET_QTY': tq.array}).merge(
+        _worker['base'], on='NORMALIZED_CODE', how='left')
+    found = merged['source'].notna().to_numpy()
 
-# Save Summary
-if summary_stats:
-    pd.DataFrame(summary_stats).to_excel(writer, sheet_name='SUMMARY', index=False)
+    # Calculate!
+    bq_arr = merged['BASE_QTY'].to_numpy(dtype=object)
+    tq_arr = merged['TARGET_QTY'].to_numpy(dtype=object)
+    adj_factor, proof_qty, is_valid = calculate_safe_adjustments(bq_arr[found], tq_arr[found])
+    success_count = sum(is_valid)
 
-# ---- 4. Create Instruction Cover Sheet (Documentation) ----
-if not args.no_cover:
+    # Pre-allocated columns filled by position (MISSING_BASE rows keep their place)
+    n = len(tk)
+    base_col = np.full(n, 'N/A', dtype=object)
+    adj_col = np.full(n, 'N/A', dtype=object)
+    proof_col = np.full(n, None, dtype=object)
+    status_col = np.full(n, 'MISSING_BASE', dtype=object)
+    base_col[found] = bq_arr[found]
+    adj_col[found] = [float(a) if a is not None else None for a in adj_factor]
+    proof_col[found] = proof_qty
+    status_col[found] = ['OK' if ok else 'FAIL' for ok in is_valid]
+
+    # Plain column arrays (in AUDIT_COLUMNS order); rows are zipped lazily at write time
+    results = (tk.to_numpy(dtype=object), base_col, tq_arr, adj_col, proof_col, status_col)
+
+    return sheet, results, success_count
+
+def main(args: argparse.Namespace) -> None:
+    """Runs the full pipeline: load bases, process every target sheet, write the audit workbook."""
+    BASE_FILE = (SCRIPT_DIR / args.base).resolve()
+    SEC_FILE = (SCRIPT_DIR / args.secondary).resolve()
+    TARGET_FILE = (SCRIPT_DIR / args.target).resolve()
+    OUTPUT_FILE = (SCRIPT_DIR / args.output).resolve()
+
+    # ---- 1. Load Base Assets (Current Positions) ----
+    log(f"Loading Base Assets: {BASE_FILE.name}")
     try:
-        from openpyxl import load_workbook
-        from openpyxl.styles import Font, PatternFill, Alignment
-        
-        # Save first to allow loading
-        writer.close() 
-        wb = load_workbook(OUTPUT_FILE)
-        
-        if 'Instructions' in wb.sheetnames:
-            wb.remove(wb['Instructions'])
-        ws = wb.create_sheet('Instructions', 0)
-        
-        # Style
-        header_font = Font(color='FFFFFF', bold=True, size=18)
-        header_fill = PatternFill(start_color='003366', end_color='003366', fill_type='solid') # Dark Blue
-        
-        ws['A1'] = "FINANCIAL INDEX PRECISION FIX - DOCUMENTATION"
-        ws['A1'].font = header_font
-        ws['A1'].fill = header_fill
-        ws.merge_cells('A1:E2')
-        
-        ws['B4'] = "Mathematical Logic:"
-        ws['B4'].font = Font(bold=True, size=12)
-        
-        explanation = [
-            "1. Problem: Legacy systems truncate decimal values, causing off-by-one errors.",
-            "2. Goal: Find 'p' such that TRUNC( Base * (1 + p) ) == Target.",
-            "3. Solution: Calculate p = (Target / Base) - 1 + Epsilon.",
-            "4. Safety: 'Epsilon' ensures the float representation is slightly above the mathematical threshold."
-        ]
-        
-        for i, line in enumerate(explanation):
-            ws.cell(row=5+i, column=2).value = line
-            
-        wb.save(OUTPUT_FILE)
-        log("Documentation cover sheet added.")
-    except Exception as e:
-        log(f"Cover sheet generation skipped: {e}")
-        # If cover fails, just close the writer if not closed
-        try: writer.close() 
-        except: pass
-else:
-    writer.close()
-
-log(f"Process Complete. Results saved to: {OUTPUT_FILE.name}")
\ No newline at end of file
+        df_base = pd.read_excel(BASE_FILE, sheet_name=0, engine=READ_ENGINE)
+    except FileNotFoundError:
+        log("Base file not found. Please provide a valid .xlsx file.")
+        exit(1)
+
+    # Dynamic Column Mapping (Agnostic to file format)
+    colmap = column_map(tuple(df_base.columns))
+    col_code = colmap.get('ticker') or colmap.get('symbol') or colmap.get('code')
+    # Logic to find the quantity column (looks for 'qty', 'shares', 'position')
+    col_qty = None
+    for k, v in colmap.items():
+        if ('qty' in k) or ('quantity' in k) or ('position' in k):
+            col_qty = v; break
+
+    if not col_code or not col_qty:
+        # Fallback for demo purposes if columns are missing
+        log("Warning: Specific columns not found, using generic column indices 0 and 1.")
+        df_base.columns = ['Ticker', 'Qty'] + list(df_base.columns[2:])
+        col_code = 'Ticker'
+        col_qty = 'Qty'
+
+    df_base['NORMALIZED_CODE'] = df_base[col_code].astype(str).str.strip()
+    df_base['BASE_QTY'] = safe_int_series(df_base[col_qty])
+    log(f"Base Assets Loaded: {df_base['NORMALIZED_CODE'].nunique()} records.")
+
+    # ---- 2. Load Secondary Assets (Optional - e.g. DRs/Receipts) ----
+    df_sec = None
+    if SEC_FILE.exists():
+        log(f"Loading Secondary Assets: {SEC_FILE.name}")
+        df_sec = pd.read_excel(SEC_FILE, sheet_name=0, engine=READ_ENGINE)
+        # ... (Similar dynamic mapping logic would go here) ...
+        # Simplified for the portfolio version:
+        colmap_sec = column_map(tuple(df_sec.columns))
+        col_code_sec = colmap_sec.get('ticker') or list(df_sec.columns)[0]
+        col_qty_sec = colmap_sec.get('qty') or list(df_sec.columns)[-1]
+
+        df_sec['NORMALIZED_CODE'] = df_sec[col_code_sec].astype(str).str.strip()
+        df_sec['BASE_QTY'] = safe_int_series(df_sec[col_qty_sec])
+
+    base_union = build_base_union(df_base, df_sec)
+
+    # ---- 3. Open Target Portfolios ----
+    log(f"Processing Target Portfolios: {TARGET_FILE.name}")
+    xls = None
+    if not TARGET_FILE.exists():
+        log("Target file not found. Creating dummy output for demonstration.")
+        sheet_names = []
+    else:
+        xls = pd.ExcelFile(str(TARGET_FILE), engine=READ_ENGINE)
+        sheet_names = xls.sheet_names
+    workers = min(args.workers or os.cpu_count() or 1, len(sheet_names))
+    # Pool workers open their own handle; only the serial path reuses this one
+    if xls is not None and workers > 1:
+        xls.close()
+        xls = None
+
+    # ---- 4. Create Output Workbook and Instruction Cover Sheet (Documentation) ----
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font, PatternFill
+
+    # Write-only workbook streams each appended row to disk; sheets are written in order, cover first
+    wb = Workbook(write_only=True)
+
+    if not args.no_cover:
+        ws = None
+        try:
+            ws = add_sheet(wb, 'Instructions')
+
+            # Style
+            header_font = Font(color='FFFFFF', bold=True, size=18)
+            header_fill = PatternFill(start_color='003366', end_color='003366', fill_type='solid') # Dark Blue
+
+            title = WriteOnlyCell(ws, value="FINANCIAL INDEX PRECISION FIX - DOCUMENTATION")
+            title.font = header_font
+            title.fill = header_fill
+            ws.append([title])
+            ws.append([])
+            ws.merged_cells.add('A1:E2')
+            ws.append([])
+
+            subtitle = WriteOnlyCell(ws, value="Mathematical Logic:")
+            subtitle.font = Font(bold=True, size=12)
+            ws.append([None, subtitle])
+
+            explanation = [
+                "1. Problem: Legacy systems truncate decimal values, causing off-by-one errors.",
+                "2. Goal: Find 'p' such that TRUNC( Base * (1 + p) ) == Target.",
+                "3. Solution: Calculate p = (Target / Base) - 1 + Epsilon.",
+                "4. Safety: 'Epsilon' ensures the float representation is slightly above the mathematical threshold."
+            ]
+
+            for line in explanation:
+                ws.append([None, line])
+
+            log("Documentation cover sheet added.")
+        except Exception as e:
+            log(f"Cover sheet generation skipped: {e}")
+            # Don't ship a half-built cover
+            if ws is not None:
+                wb.remove(ws)
+
+    # ---- 5. Process Target Portfolios ----
+    summary_stats = []
+    init = (str(TARGET_FILE), base_union)
+    if workers > 1:
+        pool = ProcessPoolExecutor(workers, initializer=_init_worker, initargs=init)
+        outputs = pool.map(_process_sheet, sheet_names)
+    else:
+        pool = None
+        _init_worker(*init, xls=xls)
+        outputs = map(_process_sheet, sheet_names)
+
+    try:
+        # Results arrive in sheet order; the workbook is only ever written from here
+        for sheet, results, success_count in outputs:
+            if results is None:
+                continue
+            # add_sheet() may truncate or suffix the name; SUMMARY points at the real sheet
+            ws = add_sheet(wb, sheet)
+            write_rows(ws, AUDIT_COLUMNS, zip(*results))
+            summary_stats.append((ws.title, success_count, len(results[0])))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        if xls is not None:
+            xls.close()
+
+    # Save Summary
+    if summary_stats or not wb.sheetnames:
+        write_rows(add_sheet(wb, 'SUMMARY'), ['Portfolio', 'Success', 'Total'], summary_stats)
+
+    wb.save(OUTPUT_FILE)
+
+    log(f"Process Complete. Results saved to: {OUTPUT_FILE.name}")
+
+if __name__ == '__main__':
+    main(args)
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""Consistency checks for the vectorized paths against their scalar originals."""
+
+import random
+import unittest
+
+import pandas as pd
+
+from index_precision_fix import (calculate_safe_adjustment, calculate_safe_adjustments,
+                                 safe_decimal_int, safe_int_series)
+
+
+def _as_list(col: pd.Series) -> list:
+    return [None if pd.isna(x) else x for x in col]
+
+
+class SafeIntSeriesTest(unittest.TestCase):
+    def assertMatchesScalar(self, col: pd.Series) -> None:
+        self.assertEqual(_as_list(safe_int_series(col)), [safe_decimal_int(x) for x in col])
+
+    def test_datetime_column(self):
+        self.assertMatchesScalar(pd.Series(pd.to_datetime(['2024-01-01', None])))
+
+    def test_timedelta_column(self):
+        self.assertMatchesScalar(pd.Series(pd.to_timedelta(['1 day', '2 days'])))
+
+    def test_bool_columns(self):
+        self.assertMatchesScalar(pd.Series([True, False]))
+        self.assertMatchesScalar(pd.Series([True, 5, 2.0, None], dtype=object))
+
+    def test_text_column(self):
+        self.assertMatchesScalar(pd.Series(['10', ' 7 ', 'abc', '3.9', '1e3', None, '12345678901234567890']))
+
+    def test_numeric_columns(self):
+        self.assertMatchesScalar(pd.Series([1, 2, 3]))
+        self.assertMatchesScalar(pd.Series([1.0, 2.5, float('nan'), 2.0 ** 60]))
+
+
+class SafeAdjustmentsTest(unittest.TestCase):
+    """The batch (int64 kernel) path must agree with the scalar exact path."""
+
+    def assertMatchesScalar(self, Bs: list, Ts: list, N: int) -> None:
+        batch = calculate_safe_adjustments(Bs, Ts, N)
+        for i, (B, T) in enumerate(zip(Bs, Ts)):
+            self.assertEqual(tuple(col[i] for col in batch), calculate_safe_adjustment(B, T, N),
+                             f"B={B} T={T} N={N}")
+
+    def test_int64_boundary(self):
+        edges = [1, 2, 3, 99, 100, 101, 10 ** 6, 2 ** 31, 2 ** 53 + 1, 2 ** 56 - 1, 2 ** 56,
+                 2 ** 62 - 1, 2 ** 62, 2 ** 63 - 2, 2 ** 63 - 1]
+        pairs = [(B, T) for B in edges for T in edges + [0]]
+        # Every value must fit int64, or the whole batch skips the kernel
+        pairs += [(B, B + d) for B in edges[:-1] for d in (-1, 1)]
+        Bs, Ts = zip(*pairs)
+        for N in (0, 2, 13):
+            self.assertMatchesScalar(list(Bs), list(Ts), N)
+
+    def test_random_pairs(self):
+        rng = random.Random(0)
+        Bs, Ts = [], []
+        for _ in range(20000):
+            B = rng.randrange(1, 2 ** rng.randrange(1, 57))
+            # Mostly small moves around B, with some targets just under the int64 ceiling
+            if rng.random() < 0.8:
+                T = max(0, B + rng.randrange(-B, B + 1) // rng.choice((1, 10, 1000, 10 ** 6)))
+            else:
+                T = 2 ** rng.choice((62, 63)) - rng.randrange(1, 10 ** 5)
+            Bs.append(B); Ts.append(T)
+        self.assertMatchesScalar(Bs, Ts, 13)
+
+
+if __name__ == '__main__':
+    unittest.main()